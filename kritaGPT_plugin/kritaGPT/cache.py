@@ -0,0 +1,109 @@
+"""
+Cache Module for KritaGPT
+Reuses generated code for repeated (or, optionally, paraphrased) commands
+and persists command history between sessions
+"""
+
+import hashlib
+import threading
+from collections import deque
+from typing import Hashable, List, Optional
+
+# diskcache persists the cache between sessions; fall back to memory without it
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+# numpy is only needed for the optional semantic tier
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Minimum cosine similarity for a paraphrased command to reuse cached code
+SIMILARITY_THRESHOLD = 0.95
+
+class ResponseCache:
+    def __init__(self, directory, semantic: bool = False):
+        """Open the cache stored in directory"""
+        self._store = diskcache.Cache(str(directory)) if diskcache else {}
+        self.semantic = semantic and np is not None
+        
+        # Semantic tier: normalised command embeddings (N, D), their code and
+        # the document context each was generated for
+        self._lock = threading.Lock()
+        self._embeddings = None
+        self._emb_codes: List[str] = []
+        self._emb_contexts: List[Hashable] = []
+    
+    @staticmethod
+    def make_key(provider: str, model: str, temperature: float, prompt: str) -> str:
+        """Build the exact-match key for a prompt
+        
+        Pass the full prompt, not just the command: it carries the document
+        size, layer and selection that generated code often hard-codes.
+        """
+        raw = f"{provider}|{model}|{temperature}|{prompt}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return cached code for an exact key, or None"""
+        return self._store.get(key)
+    
+    def get_similar(self, embedding, context: Hashable = None) -> Optional[str]:
+        """Return cached code for the most similar earlier command in the same context, or None"""
+        if not self.semantic or embedding is None:
+            return None
+        
+        query = self._normalize(embedding)
+        with self._lock:
+            if self._embeddings is None:
+                return None
+            same = np.fromiter((c == context for c in self._emb_contexts), bool, len(self._emb_contexts))
+            if not same.any():
+                return None
+            sims = np.where(same, self._embeddings @ query, -1.0)
+            best = int(sims.argmax())
+            if sims[best] > SIMILARITY_THRESHOLD:
+                return self._emb_codes[best]
+        return None
+    
+    def set(self, key: str, code: str, embedding=None, context: Hashable = None):
+        """Store code under key, and under its embedding and context if semantic caching is on"""
+        self._store[key] = code
+        
+        if not self.semantic or embedding is None:
+            return
+        
+        vec = self._normalize(embedding)
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = vec[None, :]
+            else:
+                self._embeddings = np.vstack([self._embeddings, vec])
+            self._emb_codes.append(code)
+            self._emb_contexts.append(context)
+    
+    def clear(self):
+        """Remove every cached response"""
+        self._store.clear()
+        with self._lock:
+            self._embeddings = None
+            self._emb_codes = []
+            self._emb_contexts = []
+    
+    @staticmethod
+    def _normalize(embedding):
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+def open_history(directory):
+    """Open the persistent command history stored in directory
+    
+    Returns an in-memory deque (lost on restart) if diskcache is not installed.
+    """
+    if diskcache:
+        return diskcache.Deque(directory=str(directory))
+    return deque()
@@ -3,11 +3,195 @@ Command Processor Module for KritaGPT
 Validates and executes generated Python code safely
 """
 
-import sys
+import ast
+import hashlib
+import re
 import traceback
+from functools import lru_cache
 from typing import Dict, Any, Optional
-from krita import Krita
-from PyQt5.QtCore import QObject, pyqtSignal
+from krita import Krita, Selection
+from PyQt5.QtCore import QObject, QPointF, QRectF, pyqtSignal
+
+# Names that may not be called from generated code
+BANNED_CALLS = frozenset({
+    'eval', 'exec', 'compile', 'open', 'input', 'execfile', 'reload',
+    'globals', 'locals', 'vars', 'setattr', 'delattr', '__import__',
+})
+
+# Introspection hooks that allow escaping the execution namespace
+BANNED_ATTRS = frozenset({
+    '__class__', '__bases__', '__subclasses__', '__dict__',
+    '__globals__', '__builtins__',
+})
+
+# Modules generated code is allowed to import whole
+ALLOWED_IMPORTS = frozenset({'math', 'json', 're', 'krita'})
+
+# Names generated code may take with "from <module> import"; None allows any name.
+# PyQt5 is limited to value types, since the rest reaches processes, files and
+# the network (e.g. QProcess.startDetached)
+ALLOWED_FROM_IMPORTS = {
+    'math': None,
+    'json': None,
+    're': None,
+    'krita': None,  # "from krita import *" is how Krita scripts usually start
+    'PyQt5.QtCore': frozenset({'Qt', 'QPoint', 'QPointF', 'QRect', 'QRectF', 'QSize', 'QSizeF'}),
+}
+
+def _check_import(node):
+    for alias in node.names:
+        if alias.name not in ALLOWED_IMPORTS:
+            return f"import {alias.name}"
+    return None
+
+def _check_import_from(node):
+    module = f"{'.' * node.level}{node.module or ''}"
+    if node.level or module not in ALLOWED_FROM_IMPORTS:
+        return f"from {module} import"
+    allowed = ALLOWED_FROM_IMPORTS[module]
+    if allowed is not None:
+        for alias in node.names:
+            if alias.name not in allowed:
+                return f"from {module} import {alias.name}"
+    return None
+
+def _check_call(node):
+    func = node.func
+    if isinstance(func, ast.Name):
+        if func.id in BANNED_CALLS:
+            return f"{func.id}("
+        if func.id in ('getattr', 'hasattr') and len(node.args) > 1:
+            # Only literal, non-dunder attribute names are allowed
+            name = node.args[1]
+            if not (isinstance(name, ast.Constant) and isinstance(name.value, str)
+                    and not name.value.startswith('__')):
+                return f"{func.id}() with a dynamic attribute name"
+    return None
+
+def _check_attribute(node):
+    if node.attr.startswith('__'):
+        return node.attr
+    return None
+
+def _check_name(node):
+    if node.id in BANNED_ATTRS or node.id == '__import__':
+        return node.id
+    return None
+
+# Non-existent or misused Krita API calls listed under "DO NOT USE" in the API reference
+FORBIDDEN_APIS = ("node.clear(", ".fillPixelSelection(", ".setTransparency(", ".rotate(")
+
+# All forbidden patterns in one alternation, so the code is scanned only once
+_FORBIDDEN_RE = re.compile('|'.join(re.escape(p) for p in FORBIDDEN_APIS))
+
+def find_forbidden(code: str):
+    """Return the forbidden API patterns found in code, in order of appearance"""
+    return list(dict.fromkeys(_FORBIDDEN_RE.findall(code)))
+
+# Krita API names that only work with an open document
+_DOC_REQ_RE = re.compile(r'\b(?:activeNode|createNode|selection|rootNode|setSelection|refreshProjection)\b')
+
+# Single-pass dispatch table used by CommandProcessor.validate_code
+_NODE_CHECKS = {
+    ast.Import: _check_import,
+    ast.ImportFrom: _check_import_from,
+    ast.Call: _check_call,
+    ast.Attribute: _check_attribute,
+    ast.Name: _check_name,
+}
+
+def _is_refresh(node):
+    """True for a statement that only calls <something>.refreshProjection()"""
+    return (isinstance(node, ast.Expr) and isinstance(node.value, ast.Call)
+            and isinstance(node.value.func, ast.Attribute)
+            and node.value.func.attr == 'refreshProjection')
+
+# Nodes opening a new scope, and statements that can skip the rest of a block
+_SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)
+_JUMPS = (ast.Return, ast.Break, ast.Continue, ast.Raise)
+
+def _walk_scope(node):
+    """Like ast.walk, but without entering nested functions, lambdas or classes"""
+    todo = [node]
+    while todo:
+        node = todo.pop()
+        yield node
+        if not isinstance(node, _SCOPES):
+            todo.extend(ast.iter_child_nodes(node))
+
+def _refresh_receiver(node):
+    """Name a refresh statement is called on, or None if it is not a plain name"""
+    receiver = node.value.func.value
+    return receiver.id if isinstance(receiver, ast.Name) else None
+
+class _CodeOptimizer(ast.NodeTransformer):
+    """Cheap rewrites applied to generated code before compiling
+    
+    Each refreshProjection() repaints the whole canvas, so within every block
+    a refresh statement makes earlier refreshes of the same name in that block
+    redundant, including ones nested in earlier statements. Nothing is dropped
+    across a statement that rebinds the name (execute() has already bound doc
+    and app, so a rebinding can point them at another document) or that could
+    jump past the kept call.
+    """
+    
+    def __init__(self, tree):
+        # Names that other scopes may rebind behind the block's back
+        self._shared = {
+            name
+            for node in ast.walk(tree)
+            if isinstance(node, (ast.Global, ast.Nonlocal))
+            for name in node.names
+        }
+        self._drop = set()
+        for node in ast.walk(tree):
+            for field in ('body', 'orelse', 'finalbody'):
+                stmts = getattr(node, field, None)
+                if isinstance(stmts, list):
+                    self._coalesce(stmts)
+    
+    def _coalesce(self, stmts):
+        """Mark refreshes made redundant by a later refresh statement in stmts"""
+        for i, stmt in enumerate(stmts):
+            if not _is_refresh(stmt):
+                continue
+            name = _refresh_receiver(stmt)
+            if name is None or name in self._shared:
+                continue
+            for prev in reversed(stmts[:i]):
+                nodes = list(_walk_scope(prev))
+                if any(isinstance(node, _JUMPS) for node in nodes):
+                    break
+                if any(isinstance(node, ast.Name) and node.id == name
+                       and not isinstance(node.ctx, ast.Load) for node in nodes):
+                    break
+                self._drop.update(
+                    id(node) for node in nodes
+                    if _is_refresh(node) and _refresh_receiver(node) == name
+                )
+    
+    def generic_visit(self, node):
+        node = super().generic_visit(node)
+        # Statement bodies emptied by dropped calls must stay valid
+        body = getattr(node, 'body', None)
+        if isinstance(body, list) and not body and not isinstance(node, ast.Module):
+            body.append(ast.copy_location(ast.Pass(), node))
+        if isinstance(node, ast.Try) and not node.handlers and not node.finalbody:
+            node.finalbody.append(ast.copy_location(ast.Pass(), node))
+        return node
+    
+    def visit_Expr(self, node):
+        if id(node) in self._drop:
+            return None
+        return self.generic_visit(node)
+
+@lru_cache(maxsize=128)
+def _compile_cached(src: str, optimize: bool = False):
+    """Parse (and optionally optimize) and compile source once, returning (tree, code object)"""
+    tree = ast.parse(src)
+    if optimize:
+        tree = ast.fix_missing_locations(_CodeOptimizer(tree).visit(tree))
+    return tree, compile(tree, '<kritagpt>', 'exec')
 
 class CommandProcessor(QObject):
     # Signals for UI updates
@@ -15,66 +199,82 @@ class CommandProcessor(QObject):
     execution_completed = pyqtSignal(dict)
     execution_error = pyqtSignal(str)
     
-    def __init__(self):
+    def __init__(self, trusted_hashes=None, optimize_code=True):
         super().__init__()
-        self.last_state = None
+        # SHA-256 hashes of snippets the user marked as trusted
+        self.trusted_hashes = set(trusted_hashes or ())
+        # Apply _CodeOptimizer rewrites when compiling
+        self.optimize_code = optimize_code
+        # (document name, active node name) captured by save_state()
+        self._state_snapshot = None
         self.execution_namespace = {}
+        # Names available to every execution; copied per call
+        self._base_ns = {
+            'Krita': Krita,
+            'QPointF': QPointF,
+            'QRectF': QRectF,
+            'Selection': Selection,
+            '__builtins__': __builtins__
+        }
     
     def validate_code(self, code: str) -> Dict[str, Any]:
         """Validate code for safety before execution"""
         if not code or not code.strip():
             return {"valid": False, "error": "Empty code"}
         
-        # List of potentially dangerous operations
-        dangerous_patterns = [
-            "import os",
-            "import subprocess",
-            "import sys",
-            "__import__",
-            "eval(",
-            "exec(",
-            "compile(",
-            "open(",
-            "file(",
-            "input(",
-            "raw_input(",
-            "execfile(",
-            "reload(",
-            "globals(",
-            "locals(",
-            "__builtins__",
-            "setattr(",
-            "delattr(",
-            "__dict__",
-            "__class__",
-            "__bases__",
-            "__subclasses__",
-        ]
+        # Parse and compile once; repeated snippets hit the cache
+        try:
+            tree, code_obj = _compile_cached(code, self.optimize_code)
+        except SyntaxError as e:
+            return {
+                "valid": False,
+                "error": f"Syntax error: {str(e)}"
+            }
         
-        code_lower = code.lower()
-        for pattern in dangerous_patterns:
-            if pattern.lower() in code_lower:
-                # Allow some safe imports
-                if pattern == "import sys" and "sys.path" not in code_lower:
-                    continue
+        for node in ast.walk(tree):
+            check = _NODE_CHECKS.get(type(node))
+            if check is None:
+                continue
+            error = check(node)
+            if error:
                 return {
                     "valid": False,
-                    "error": f"Potentially unsafe operation detected: {pattern}"
+                    "error": f"Potentially unsafe operation detected: {error}"
                 }
         
-        # Check for basic syntax
+        return {"valid": True, "error": None, "code_obj": code_obj}
+    
+    def compile_trusted(self, code: str) -> Dict[str, Any]:
+        """Compile trusted code without the safety checks"""
         try:
-            compile(code, '<string>', 'exec')
+            _, code_obj = _compile_cached(code, self.optimize_code)
         except SyntaxError as e:
             return {
                 "valid": False,
                 "error": f"Syntax error: {str(e)}"
             }
-        
-        return {"valid": True, "error": None}
+        return {"valid": True, "error": None, "code_obj": code_obj}
+    
+    @staticmethod
+    def code_hash(code: str) -> str:
+        """Return the SHA-256 hex digest identifying a snippet"""
+        return hashlib.sha256(code.encode("utf-8")).hexdigest()
+    
+    def trust(self, code: str) -> str:
+        """Mark a snippet as trusted and return its hash"""
+        digest = self.code_hash(code)
+        self.trusted_hashes.add(digest)
+        return digest
+    
+    def clear_cache(self):
+        """Drop compiled code objects kept for repeated snippets"""
+        _compile_cached.cache_clear()
     
     def save_state(self):
         """Save current document state for potential undo"""
+        # Krita's document API is not thread-safe, so the snapshot is taken
+        # here on the GUI thread; only the cheap name lookups happen now and
+        # the dict is built on demand by last_state
         try:
             app = Krita.instance()
             doc = app.activeDocument()
@@ -82,12 +282,18 @@ class CommandProcessor(QObject):
             if doc:
                 # In a real implementation, we might save more complex state
                 # For now, we'll rely on Krita's built-in undo system
-                self.last_state = {
-                    "document": doc.name(),
-                    "active_node": doc.activeNode().name() if doc.activeNode() else None
-                }
+                node = doc.activeNode()
+                self._state_snapshot = (doc.name(), node.name() if node else None)
         except:
-            self.last_state = None
+            self._state_snapshot = None
+    
+    @property
+    def last_state(self) -> Optional[Dict[str, Any]]:
+        """Document state captured before the last execution"""
+        if self._state_snapshot is None:
+            return None
+        document, active_node = self._state_snapshot
+        return {"document": document, "active_node": active_node}
     
     def execute(self, code: str, auto_execute: bool = True) -> Dict[str, Any]:
         """Execute validated Python code in Krita context"""
@@ -99,8 +305,11 @@ class CommandProcessor(QObject):
                 "executed": False
             }
         
-        # Validate first
-        validation = self.validate_code(code)
+        # Validate first; trusted snippets only need compiling
+        if self.code_hash(code) in self.trusted_hashes:
+            validation = self.compile_trusted(code)
+        else:
+            validation = self.validate_code(code)
         if not validation["valid"]:
             return {
                 "success": False,
@@ -116,27 +325,13 @@ class CommandProcessor(QObject):
         self.execution_started.emit()
         
         # Prepare execution namespace with Krita context
-        namespace = {
-            'Krita': Krita,
-            'app': Krita.instance(),
-            'doc': Krita.instance().activeDocument() if Krita.instance() else None,
-            '__builtins__': __builtins__,
-            'QPointF': None,  # Will be imported if needed
-            'QRectF': None,   # Will be imported if needed
-            'Selection': None  # Will be imported if needed
-        }
-        
-        # Add PyQt imports if needed
-        if 'QPointF' in code or 'QRectF' in code or 'Selection' in code:
-            from PyQt5.QtCore import QPointF, QRectF
-            from krita import Selection
-            namespace['QPointF'] = QPointF
-            namespace['QRectF'] = QRectF
-            namespace['Selection'] = Selection
+        namespace = dict(self._base_ns)
+        namespace['app'] = Krita.instance()
+        namespace['doc'] = namespace['app'].activeDocument() if namespace['app'] else None
         
         try:
-            # Execute the code
-            exec(code, namespace)
+            # Execute the code object compiled during validation
+            exec(validation["code_obj"], namespace)
             
             # Refresh the canvas if document exists
             if namespace.get('doc'):
@@ -179,12 +374,7 @@ class CommandProcessor(QObject):
             }
         
         # Check if we have an active document for operations that need it
-        doc_required_operations = [
-            'activeNode', 'createNode', 'selection', 'rootNode',
-            'setSelection', 'refreshProjection'
-        ]
-        
-        needs_document = any(op in code for op in doc_required_operations)
+        needs_document = _DOC_REQ_RE.search(code) is not None
         
         if needs_document and not Krita.instance().activeDocument():
             return {
@@ -3,14 +3,34 @@ Configuration module for KritaGPT
 Handles API keys, settings, and constants
 """
 
+import copy
 import json
 import os
+from functools import lru_cache
 from pathlib import Path
+from typing import Dict, Optional, Tuple
+from PyQt5.QtCore import QCoreApplication, QTimer
+
+# Parsed config files shared by all Config instances: path -> (mtime_ns, data)
+_CACHE: Dict[Path, Tuple[int, dict]] = {}
+
+# Delay before pending set() calls are written to disk
+SAVE_DELAY_MS = 500
 
 class Config:
     def __init__(self):
         self.config_dir = Path.home() / ".kritaGPT"
         self.config_file = self.config_dir / "config.json"
+        
+        # Coalesce rapid set() calls into a single write
+        self._dirty = False
+        self._save_timer = QTimer()
+        self._save_timer.setSingleShot(True)
+        self._save_timer.timeout.connect(self.flush)
+        app = QCoreApplication.instance()
+        if app:
+            app.aboutToQuit.connect(self.flush)
+        
         self.ensure_config_dir()
         self.load_config()
     
@@ -21,16 +41,34 @@ class Config:
     def load_config(self):
         """Load configuration from file"""
         if self.config_file.exists():
+            mtime = self.config_file.stat().st_mtime_ns
+            cached = _CACHE.get(self.config_file)
+            if cached and cached[0] == mtime:
+                self.data = copy.deepcopy(cached[1])
+                return
             with open(self.config_file, 'r') as f:
                 self.data = json.load(f)
+            _CACHE[self.config_file] = (mtime, copy.deepcopy(self.data))
         else:
             self.data = self.get_default_config()
             self.save_config()
     
     def save_config(self):
         """Save configuration to file"""
-        with open(self.config_file, 'w') as f:
+        # Write to a temporary file first so a crash never leaves a truncated config
+        tmp_file = self.config_file.with_suffix(".json.tmp")
+        with open(tmp_file, 'w') as f:
             json.dump(self.data, f, indent=2)
+        os.replace(tmp_file, self.config_file)
+        
+        _CACHE[self.config_file] = (self.config_file.stat().st_mtime_ns, copy.deepcopy(self.data))
+        self._dirty = False
+    
+    def flush(self):
+        """Write pending changes to disk"""
+        self._save_timer.stop()
+        if self._dirty:
+            self.save_config()
     
     def get_default_config(self):
         """Return default configuration"""
@@ -44,7 +82,13 @@ class Config:
             "show_code": False,
             "history_size": 10,
             "timeout": 30,
-            "auto_execute": True
+            "auto_execute": True,
+            "trusted_hashes": [],
+            "max_concurrency": 4,
+            "semantic_cache": False,
+            "use_batch_api": False,
+            "optimize_generated_code": True,
+            "api_sections_top_k": 3  # 0 sends the full API reference
         }
     
     def get(self, key, default=None):
@@ -58,17 +102,15 @@ class Config:
         return self.data.get(key, default)
     
     def set(self, key, value):
-        """Set configuration value"""
+        """Set configuration value (written to disk after a short delay)"""
         self.data[key] = value
-        self.save_config()
-
-# Import the comprehensive API documentation
-from .krita_api_docs import KRITA_API_REFERENCE
+        self._dirty = True
+        self._save_timer.start(SAVE_DELAY_MS)
 
-# System prompt for GPT/Claude with full API documentation
-SYSTEM_PROMPT = f"""You are a Krita automation assistant. Convert user commands to Krita Python code.
+# System prompt for GPT/Claude; {api} is replaced with the full API documentation
+_PROMPT_TEMPLATE = """You are a Krita automation assistant. Convert user commands to Krita Python code.
 
-{KRITA_API_REFERENCE}
+{api}
 
 STRICT INSTRUCTIONS:
 1. ONLY use methods that are documented above
@@ -79,11 +121,31 @@ STRICT INSTRUCTIONS:
 6. Always use math.radians() for rotations
 7. Always check if doc and nodes exist
 8. Always end with doc.refreshProjection()
+9. If the command has several steps, return ONE script that performs them all in order
 
 If a requested operation cannot be done with the documented API, respond with valid Python:
 print("Cannot perform this operation - method not available in Krita API")
 """
 
+def _load_api_reference(sections: Optional[Tuple[str, ...]] = None) -> str:
+    """Import the comprehensive API documentation on first use"""
+    from .krita_api_docs import KRITA_API_REFERENCE, build_api_reference
+    if sections is None:
+        return KRITA_API_REFERENCE
+    return build_api_reference(sections)
+
+@lru_cache(maxsize=64)
+def get_system_prompt(sections: Optional[Tuple[str, ...]] = None) -> str:
+    """Build the system prompt for a set of API sections (None = all), once per set"""
+    return _PROMPT_TEMPLATE.format(api=_load_api_reference(sections))
+
+def get_system_prompt_for(command: str, top_k: int = 3) -> str:
+    """System prompt with only the top_k API sections relevant to command"""
+    if top_k <= 0:
+        return get_system_prompt()
+    from .krita_api_docs import select_api_sections
+    return get_system_prompt(select_api_sections(command, top_k))
+
 # Model configurations
 MODELS = {
     "openai": {
@@ -115,4 +177,15 @@ MODELS = {
             "cost_per_1k": 0.00025
         }
     }
-}
\ No newline at end of file
+}
+
+# Flat lookup of every model by id, including the provider it belongs to
+MODEL_INDEX = {
+    name: {**info, "provider": provider}
+    for provider, models in MODELS.items()
+    for name, info in models.items()
+}
+
+def get_model(name: str) -> dict:
+    """Get model info (with provider) by model id"""
+    return MODEL_INDEX[name]
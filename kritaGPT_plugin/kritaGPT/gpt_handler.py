@@ -3,113 +3,234 @@ GPT Handler Module for KritaGPT
 Manages communication with OpenAI and Anthropic APIs
 """
 
+import os
 import re
+import sys
 import json
-from typing import Optional, Dict, List
+import asyncio
+import threading
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import islice
+from typing import Optional, Dict, Iterator, List
 from krita import Krita
+from PyQt5.QtCore import QObject, pyqtSignal
 
-# Try to import both APIs
-try:
-    import sys
-    import os
+@lru_cache(maxsize=None)
+def _import_sdk(provider: str):
+    """Import the SDK for provider on first use; returns None if it is not installed
+    
+    Kept out of module import so loading the plugin without a configured key
+    does not pay for the SDKs and their dependencies.
+    """
     # Add Krita's site-packages to path if not already there
     site_packages = r"C:\Program Files\Krita (x64)\lib\site-packages"
     if os.path.exists(site_packages) and site_packages not in sys.path:
         sys.path.insert(0, site_packages)
-    import openai
-except ImportError as e:
-    print(f"OpenAI import error: {e}")
-    openai = None
+    try:
+        if provider == "anthropic":
+            import anthropic
+            return anthropic
+        import openai
+        return openai
+    except ImportError as e:
+        print(f"{provider.title()} import error: {e}")
+        return None
+
+@lru_cache(maxsize=None)
+def _import_httpx():
+    """Import httpx on first use; returns (httpx, http2_available) or (None, False)"""
+    try:
+        import httpx
+    except ImportError:
+        return None, False
+    # HTTP/2 needs the optional h2 package; fall back to HTTP/1.1 keep-alive without it
+    try:
+        import h2
+        return httpx, True
+    except ImportError:
+        return httpx, False
+
+from .config import get_system_prompt_for
+
+# Code fence pattern and non-code line prefixes used by extract_code
+_CODE_FENCE_RE = re.compile(r'```(?:python)?\n?(.*?)```', re.DOTALL)
+_SKIP_PREFIXES = ('Note:', 'Error:', 'Warning:', 'INFO:')
+
+# Batch API states after which no more results will arrive
+_BATCH_DONE_STATES = ("completed", "failed", "expired", "cancelled")
+
+# Embedding model used by the semantic response cache
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Connection pool shared by all requests of one handler
+HTTP_TIMEOUT = 60.0
+HTTP_LIMITS = {"max_keepalive_connections": 8, "max_connections": 16}
 
-try:
-    import anthropic
-except ImportError as e:
-    print(f"Anthropic import error: {e}")
-    anthropic = None
+# dataclass(slots=True) requires Python 3.10+
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
 
-from .config import SYSTEM_PROMPT
+@dataclass(frozen=True, **_SLOTS)
+class KritaContext:
+    """Snapshot of the Krita state that is described in the prompt"""
+    has_document: bool
+    doc_name: str = ""
+    width: int = 0
+    height: int = 0
+    layer_name: Optional[str] = None
+    layer_type: Optional[str] = None
+    has_selection: bool = False
+    sel_x: int = 0
+    sel_y: int = 0
+    sel_w: int = 0
+    sel_h: int = 0
+    # Only collected with get_context(include_full=True)
+    color_model: Optional[str] = None
+    color_depth: Optional[str] = None
+    resolution: Optional[int] = None
 
-class GPTHandler:
+class GPTHandler(QObject):
+    # Emitted with each piece of the response as it streams in
+    token_received = pyqtSignal(str)
+    
     def __init__(self, provider: str = "openai", api_key: str = "", model: str = "gpt-4", temperature: float = 0.1):
         """Initialize GPT handler with API credentials"""
+        super().__init__()
         self.provider = provider
         self.api_key = api_key
         self.model = model
         self.temperature = temperature
-        self.chat_history = []
+        # Number of API reference sections picked per command (0 = full reference)
+        self.api_top_k = 3
+        # Bounded history; the oldest messages are evicted automatically
+        self.chat_history = deque(maxlen=20)
+        # Requests run on worker and event loop threads at the same time
+        self._history_lock = threading.Lock()
+        # One keep-alive HTTP pool per handler, kept across key/provider changes
+        self._http = None
+        self._async_http = None
+        # Reused across requests so the HTTPS connection pool stays warm
+        self._client = self._create_client()
+        # Async client for concurrent batches, created on first use
+        self._async_client = None
+    
+    @staticmethod
+    def _create_http_client(async_: bool = False):
+        """Create an httpx client (sync or async) with the shared pool settings"""
+        httpx, http2 = _import_httpx()
+        if httpx is None:
+            return None
+        cls = httpx.AsyncClient if async_ else httpx.Client
+        return cls(http2=http2, timeout=HTTP_TIMEOUT, limits=httpx.Limits(**HTTP_LIMITS))
+    
+    def _create_client(self):
+        """Create the API client for the current provider and key"""
+        if not self.api_key:
+            return None
+        sdk = _import_sdk(self.provider)
+        if sdk is None:
+            return None
+        try:
+            if self._http is None:
+                self._http = self._create_http_client()
+            if self.provider == "anthropic":
+                return sdk.Anthropic(api_key=self.api_key, http_client=self._http)
+            return sdk.OpenAI(api_key=self.api_key, http_client=self._http)
+        except Exception as e:
+            print(f"{self.provider.title()} client error: {e}")
+            return None
     
-    def get_context(self) -> Dict:
-        """Get current Krita context information"""
+    def _create_async_client(self):
+        """Create the asyncio API client for the current provider and key"""
+        sdk = _import_sdk(self.provider)
+        if self._async_http is None:
+            self._async_http = self._create_http_client(async_=True)
+        if self.provider == "anthropic":
+            return sdk.AsyncAnthropic(api_key=self.api_key, http_client=self._async_http)
+        return sdk.AsyncOpenAI(api_key=self.api_key, http_client=self._async_http)
+    
+    def get_context(self, include_full: bool = False) -> KritaContext:
+        """Get current Krita context information
+        
+        Only the fields used by the prompt are fetched unless include_full is set,
+        since every call crosses into Krita's C++ API.
+        """
         app = Krita.instance()
         doc = app.activeDocument()
         
-        context = {
-            "has_document": doc is not None,
-            "document_info": {},
-            "active_layer": None,
-            "selection": False
-        }
+        if not doc:
+            return KritaContext(has_document=False)
         
-        if doc:
-            context["document_info"] = {
-                "width": doc.width(),
-                "height": doc.height(),
-                "name": doc.name(),
-                "colorDepth": doc.colorDepth(),
-                "colorModel": doc.colorModel(),
+        node = doc.activeNode()
+        sel = doc.selection()
+        
+        extra = {}
+        if include_full:
+            extra = {
+                "color_model": doc.colorModel(),
+                "color_depth": doc.colorDepth(),
                 "resolution": doc.resolution()
             }
-            
-            active_node = doc.activeNode()
-            if active_node:
-                context["active_layer"] = {
-                    "name": active_node.name(),
-                    "type": active_node.type(),
-                    "visible": active_node.visible(),
-                    "opacity": active_node.opacity()
-                }
-            
-            selection = doc.selection()
-            if selection:
-                context["selection"] = {
-                    "x": selection.x(),
-                    "y": selection.y(),
-                    "width": selection.width(),
-                    "height": selection.height()
-                }
         
-        return context
+        return KritaContext(
+            has_document=True,
+            doc_name=doc.name(),
+            width=doc.width(),
+            height=doc.height(),
+            layer_name=node.name() if node else None,
+            layer_type=node.type() if node else None,
+            has_selection=sel is not None,
+            sel_x=sel.x() if sel else 0,
+            sel_y=sel.y() if sel else 0,
+            sel_w=sel.width() if sel else 0,
+            sel_h=sel.height() if sel else 0,
+            **extra
+        )
     
-    def build_prompt(self, command: str, context: Optional[Dict] = None) -> str:
+    def build_prompt(self, command: str, ctx: Optional[KritaContext] = None) -> str:
         """Build the full prompt with context"""
-        if context is None:
-            context = self.get_context()
+        if ctx is None:
+            ctx = self.get_context()
         
-        prompt = f"User command: {command}\n\n"
+        parts: List[str] = [f"User command: {command}\n\n"]
         
-        if context["has_document"]:
-            prompt += f"Document context:\n"
-            prompt += f"- Document: {context['document_info']['name']}\n"
-            prompt += f"- Size: {context['document_info']['width']}x{context['document_info']['height']}\n"
+        if ctx.has_document:
+            parts.append("Document context:\n")
+            parts.append(f"- Document: {ctx.doc_name}\n")
+            parts.append(f"- Size: {ctx.width}x{ctx.height}\n")
+            
+            if ctx.color_model is not None:
+                parts.append(f"- Color: {ctx.color_model} {ctx.color_depth}, {ctx.resolution} ppi\n")
             
-            if context["active_layer"]:
-                prompt += f"- Active layer: '{context['active_layer']['name']}' (type: {context['active_layer']['type']})\n"
+            if ctx.layer_name is not None:
+                parts.append(f"- Active layer: '{ctx.layer_name}' (type: {ctx.layer_type})\n")
             
-            if context["selection"]:
-                sel = context["selection"]
-                prompt += f"- Selection: {sel['width']}x{sel['height']} at ({sel['x']}, {sel['y']})\n"
+            if ctx.has_selection:
+                parts.append(f"- Selection: {ctx.sel_w}x{ctx.sel_h} at ({ctx.sel_x}, {ctx.sel_y})\n")
         else:
-            prompt += "Note: No document is currently open.\n"
+            parts.append("Note: No document is currently open.\n")
         
-        prompt += "\nGenerate Python code to execute this command:"
+        parts.append("\nGenerate Python code to execute this command:")
         
-        return prompt
+        return "".join(parts)
+    
+    def recent_history(self, count: int = 10) -> List[Dict]:
+        """Snapshot of the last `count` history messages"""
+        with self._history_lock:
+            return list(islice(self.chat_history, max(0, len(self.chat_history) - count), None))
     
     def extract_code(self, response: str) -> str:
         """Extract Python code from GPT/Claude response"""
+        # Fast path: the system prompt asks for bare code, so most responses
+        # have no fences and no leading note
+        if '```' not in response:
+            stripped = response.strip()
+            if not stripped.startswith(_SKIP_PREFIXES):
+                return stripped
+        
         # Try to find code blocks with ```python or ```
-        code_pattern = r'```(?:python)?\n?(.*?)```'
-        matches = re.findall(code_pattern, response, re.DOTALL)
+        matches = _CODE_FENCE_RE.findall(response)
         
         if matches:
             return matches[0].strip()
@@ -122,72 +243,129 @@ class GPTHandler:
         for line in lines:
             # Skip obvious non-code lines
             stripped = line.strip()
-            if stripped and not stripped.startswith(('Note:', 'Error:', 'Warning:', 'INFO:')):
+            if stripped and not stripped.startswith(_SKIP_PREFIXES):
                 code_lines.append(line)
         
         return '\n'.join(code_lines)
     
-    def get_code_openai(self, command: str, context: Optional[Dict] = None) -> Dict:
-        """Get Python code from OpenAI GPT"""
-        if not openai:
+    def _check_ready(self) -> Optional[Dict]:
+        """Return an error result if the provider library or API key is missing"""
+        name = "Anthropic" if self.provider == "anthropic" else "OpenAI"
+        
+        if not _import_sdk(self.provider):
             return {
                 "success": False,
-                "error": "OpenAI library not installed. Please install with: pip install openai",
+                "error": f"{name} library not installed. Please install with: pip install {name.lower()}",
                 "code": None
             }
         
-        if not self.api_key:
+        if self._client is None:
             return {
                 "success": False,
-                "error": "No OpenAI API key configured. Please set your API key in settings.",
+                "error": f"No {name} API key configured. Please set your API key in settings.",
                 "code": None
             }
         
-        try:
-            # Build the prompt with context
-            prompt = self.build_prompt(command, context)
-            
-            # Create messages for chat completion
-            messages = [
-                {"role": "system", "content": SYSTEM_PROMPT}
-            ]
-            
-            # Add recent history for context (last 5 exchanges)
-            for msg in self.chat_history[-10:]:
-                messages.append(msg)
-            
-            # Add current command
-            messages.append({"role": "user", "content": prompt})
-            
-            # Call OpenAI API (v1.0+ syntax)
-            client = openai.OpenAI(api_key=self.api_key)
-            response = client.chat.completions.create(
+        return None
+    
+    def system_prompt(self, command: str) -> str:
+        """System prompt carrying the API reference sections relevant to command"""
+        return get_system_prompt_for(command, self.api_top_k)
+    
+    def _build_messages(self, prompt: str) -> List[Dict]:
+        """Recent history followed by the current prompt"""
+        # Add recent history for context (last 5 exchanges)
+        messages = self.recent_history()
+        
+        # Add current command
+        messages.append({"role": "user", "content": prompt})
+        return messages
+    
+    def _finish(self, prompt: str, raw_response: str) -> Dict:
+        """Extract code from a response and record the exchange in history"""
+        code = self.extract_code(raw_response)
+        
+        # Add to history
+        with self._history_lock:
+            self.chat_history.append({"role": "user", "content": prompt})
+            self.chat_history.append({"role": "assistant", "content": code})
+        
+        return {
+            "success": True,
+            "code": code,
+            "raw_response": raw_response,
+            "error": None
+        }
+    
+    def _stream_deltas(self, command: str, prompt: str) -> Iterator[str]:
+        """Yield pieces of the raw response text as the provider streams them"""
+        if self.provider == "anthropic":
+            with self._client.messages.stream(
                 model=self.model,
-                messages=messages,
+                system=self.system_prompt(command),
+                messages=self._build_messages(prompt),
                 temperature=self.temperature,
                 max_tokens=1500
-            )
-            
-            # Extract the response
-            gpt_response = response.choices[0].message.content
-            
-            # Extract code from response
-            code = self.extract_code(gpt_response)
+            ) as stream:
+                yield from stream.text_stream
+            return
+        
+        # Create messages for chat completion
+        messages = [{"role": "system", "content": self.system_prompt(command)}]
+        messages.extend(self._build_messages(prompt))
+        
+        # Call OpenAI API (v1.0+ syntax), streaming tokens as they arrive
+        stream = self._client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=1500,
+            stream=True
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            if delta:
+                yield delta
+    
+    async def aget_code(self, command: str, context: Optional[KritaContext] = None) -> Dict:
+        """Async variant of get_code, used to run several commands concurrently
+        
+        Pass a context captured on the GUI thread; Krita's API must not be
+        called from the event loop thread.
+        """
+        error = self._check_ready()
+        if error:
+            return error
+        
+        try:
+            prompt = self.build_prompt(command, context)
             
-            # Add to history
-            self.chat_history.append({"role": "user", "content": prompt})
-            self.chat_history.append({"role": "assistant", "content": code})
+            if self._async_client is None:
+                self._async_client = self._create_async_client()
             
-            # Keep history size manageable
-            if len(self.chat_history) > 20:
-                self.chat_history = self.chat_history[-20:]
+            if self.provider == "anthropic":
+                response = await self._async_client.messages.create(
+                    model=self.model,
+                    system=self.system_prompt(command),
+                    messages=self._build_messages(prompt),
+                    temperature=self.temperature,
+                    max_tokens=1500
+                )
+                raw_response = response.content[0].text
+            else:
+                messages = [{"role": "system", "content": self.system_prompt(command)}]
+                messages.extend(self._build_messages(prompt))
+                response = await self._async_client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=self.temperature,
+                    max_tokens=1500
+                )
+                raw_response = response.choices[0].message.content
             
-            return {
-                "success": True,
-                "code": code,
-                "raw_response": gpt_response,
-                "error": None
-            }
+            return self._finish(prompt, raw_response)
             
         except Exception as e:
             return {
@@ -196,69 +374,131 @@ class GPTHandler:
                 "code": None
             }
     
-    def get_code_anthropic(self, command: str, context: Optional[Dict] = None) -> Dict:
-        """Get Python code from Anthropic Claude"""
-        if not anthropic:
-            return {
-                "success": False,
-                "error": "Anthropic library not installed. Please install with: pip install anthropic",
-                "code": None
-            }
+    async def aget_code_batch(self, commands: List[str], context: Optional[KritaContext] = None,
+                              max_concurrency: int = 4, on_progress=None) -> List[Dict]:
+        """Request code for several commands concurrently; results keep input order"""
+        sem = asyncio.Semaphore(max_concurrency)
+        done = 0
         
-        if not self.api_key:
-            return {
-                "success": False,
-                "error": "No Anthropic API key configured. Please set your API key in settings.",
-                "code": None
-            }
+        async def one(command):
+            nonlocal done
+            async with sem:
+                result = await self.aget_code(command, context)
+            done += 1
+            if on_progress:
+                on_progress(f"Batch: {done}/{len(commands)} done")
+            return result
+        
+        return list(await asyncio.gather(*[one(c) for c in commands]))
+    
+    async def aget_code_batch_api(self, commands: List[str], context: Optional[KritaContext] = None,
+                                  poll_interval: float = 30.0, on_progress=None) -> List[Dict]:
+        """Request code through OpenAI's Batch API (half price, results within 24h)
+        
+        Falls back to concurrent requests for providers without it.
+        """
+        if self.provider != "openai":
+            return await self.aget_code_batch(commands, context, on_progress=on_progress)
+        
+        error = self._check_ready()
+        if error:
+            return [error] * len(commands)
+        
+        if self._async_client is None:
+            self._async_client = self._create_async_client()
+        client = self._async_client
+        
+        # One chat completion request per command, matched back up by custom_id
+        prompts = [self.build_prompt(c, context) for c in commands]
+        lines = [
+            json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": [
+                        {"role": "system", "content": self.system_prompt(command)},
+                        {"role": "user", "content": prompt}
+                    ],
+                    "temperature": self.temperature,
+                    "max_tokens": 1500
+                }
+            })
+            for i, (command, prompt) in enumerate(zip(commands, prompts))
+        ]
+        
+        batch_file = await client.files.create(
+            file=("kritagpt_batch.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = await client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        
+        while batch.status not in _BATCH_DONE_STATES:
+            if on_progress:
+                counts = batch.request_counts
+                done = counts.completed if counts else 0
+                on_progress(f"Batch {batch.status}: {done}/{len(commands)} done")
+            await asyncio.sleep(poll_interval)
+            batch = await client.batches.retrieve(batch.id)
+        
+        results = [{
+            "success": False,
+            "error": f"Batch {batch.status} without a result for this command",
+            "code": None
+        }] * len(commands)
+        if not batch.output_file_id:
+            return results
+        
+        output = await client.files.content(batch.output_file_id)
+        for line in output.text.splitlines():
+            item = json.loads(line)
+            i = int(item["custom_id"])
+            response = item.get("response")
+            if response and response.get("status_code") == 200:
+                raw_response = response["body"]["choices"][0]["message"]["content"]
+                results[i] = self._finish(prompts[i], raw_response)
+            else:
+                results[i] = {"success": False, "error": str(item.get("error") or response), "code": None}
+        
+        return results
+    
+    def embed(self, text: str) -> Optional[List[float]]:
+        """Embed text for the semantic response cache (OpenAI only)"""
+        if self.provider != "openai" or self._client is None:
+            return None
+        
+        try:
+            response = self._client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+            return response.data[0].embedding
+        except Exception as e:
+            print(f"Embedding error: {e}")
+            return None
+    
+    def get_code(self, command: str, context: Optional[KritaContext] = None) -> Dict:
+        """Get Python code from the configured API provider
+        
+        The response is streamed; token_received is emitted for each piece.
+        """
+        error = self._check_ready()
+        if error:
+            return error
         
         try:
             # Build the prompt with context
             prompt = self.build_prompt(command, context)
             
-            # Create messages for Claude
-            messages = []
-            
-            # Add recent history for context (last 5 exchanges)
-            for msg in self.chat_history[-10:]:
-                messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
-            # Add current command
-            messages.append({"role": "user", "content": prompt})
-            
-            # Call Anthropic API
-            client = anthropic.Anthropic(api_key=self.api_key)
-            response = client.messages.create(
-                model=self.model,
-                system=SYSTEM_PROMPT,
-                messages=messages,
-                temperature=self.temperature,
-                max_tokens=1500
-            )
+            # Collect the response
+            buf = []
+            for delta in self._stream_deltas(command, prompt):
+                buf.append(delta)
+                self.token_received.emit(delta)
             
-            # Extract the response
-            claude_response = response.content[0].text
-            
-            # Extract code from response
-            code = self.extract_code(claude_response)
-            
-            # Add to history
-            self.chat_history.append({"role": "user", "content": prompt})
-            self.chat_history.append({"role": "assistant", "content": code})
-            
-            # Keep history size manageable
-            if len(self.chat_history) > 20:
-                self.chat_history = self.chat_history[-20:]
-            
-            return {
-                "success": True,
-                "code": code,
-                "raw_response": claude_response,
-                "error": None
-            }
+            return self._finish(prompt, "".join(buf))
             
         except Exception as e:
             return {
@@ -267,20 +507,16 @@ class GPTHandler:
                 "code": None
             }
     
-    def get_code(self, command: str, context: Optional[Dict] = None) -> Dict:
-        """Get Python code from the configured API provider"""
-        if self.provider == "anthropic":
-            return self.get_code_anthropic(command, context)
-        else:
-            return self.get_code_openai(command, context)
-    
     def clear_history(self):
         """Clear chat history"""
-        self.chat_history = []
+        with self._history_lock:
+            self.chat_history.clear()
     
     def set_api_key(self, api_key: str):
         """Update API key"""
         self.api_key = api_key
+        self._client = self._create_client()
+        self._async_client = None
     
     def set_model(self, model: str):
         """Update model"""
@@ -292,4 +528,6 @@ class GPTHandler:
     
     def set_provider(self, provider: str):
         """Update API provider"""
-        self.provider = provider
\ No newline at end of file
+        self.provider = provider
+        self._client = self._create_client()
+        self._async_client = None
\ No newline at end of file
@@ -1,36 +1,53 @@
 #!/usr/bin/env python3
 """
 Installation helper for KritaGPT
-Installs the OpenAI dependency into Krita's Python environment
+Installs the OpenAI dependency (and optional extras) into Krita's Python environment
 """
 
 import subprocess
 import sys
 import os
+from importlib.metadata import PackageNotFoundError, version
 from pathlib import Path
 
+def _pip_install(packages):
+    """Run pip install for packages, streaming its output as it runs"""
+    cmd = [
+        sys.executable, "-m", "pip", "install",
+        "--disable-pip-version-check",  # skip pip's own PyPI update check
+        "--no-cache-dir",               # don't write the wheel cache
+        "--only-binary=:all:",          # never fall back to slow source builds
+        *packages,
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+    for line in proc.stdout:
+        print(line, end="")
+    proc.wait()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
 def install_openai():
     """Install OpenAI package for Krita's Python"""
     print("KritaGPT Installer")
     print("=" * 50)
     print()
     
-    # Check if openai is already installed
+    # Check if openai is already installed (reads dist-info only, no package import)
     try:
-        import openai
+        openai_version = version("openai")
         print("✓ OpenAI library is already installed")
-        print(f"  Version: {openai.__version__}")
+        print(f"  Version: {openai_version}")
         return True
-    except ImportError:
+    except PackageNotFoundError:
         print("OpenAI library not found. Installing...")
     
     # Try to install using pip
     try:
         print("Installing openai package...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "openai>=0.27.0"])
+        _pip_install(["openai>=0.27.0"])
         print("✓ OpenAI library installed successfully!")
         return True
-    except subprocess.CalledProcessError as e:
+    except (OSError, subprocess.CalledProcessError) as e:
         print(f"✗ Error installing OpenAI library: {e}")
         print()
         print("Manual installation instructions:")
@@ -39,6 +56,36 @@ def install_openai():
         print("3. Run: pip install openai")
         return False
 
+# Extras enabling optional features; KritaGPT works without them
+OPTIONAL_PACKAGES = {
+    "diskcache": "persistent command history and response cache",
+    "numpy": "semantic response cache",
+    "h2": "HTTP/2 connections to the APIs",
+}
+
+def install_optional():
+    """Install the optional packages that are missing; failures are only reported"""
+    missing = []
+    for package, feature in OPTIONAL_PACKAGES.items():
+        try:
+            version(package)
+            print(f"✓ {package} is already installed ({feature})")
+        except PackageNotFoundError:
+            missing.append(package)
+    if not missing:
+        return True
+    
+    try:
+        print(f"Installing optional packages: {', '.join(missing)}...")
+        _pip_install(missing)
+        print("✓ Optional packages installed successfully!")
+        return True
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"✗ Could not install optional packages: {e}")
+        for package in missing:
+            print(f"  Without {package}: no {OPTIONAL_PACKAGES[package]}")
+        return False
+
 def main():
     """Main installation process"""
     print("This script will install the OpenAI library required for KritaGPT.")
@@ -47,6 +94,11 @@ def main():
     # Install OpenAI
     success = install_openai()
     
+    # Optional extras never fail the installation
+    if success:
+        print()
+        install_optional()
+    
     print()
     print("=" * 50)
     
@@ -3,6 +3,12 @@ Main KritaGPT Plugin Module
 Natural language commands for Krita using GPT-4 and Claude
 """
 
+import asyncio
+import logging
+import re
+import threading
+from contextlib import contextmanager
+
 from krita import DockWidget, DockWidgetFactory, DockWidgetFactoryBase, Krita
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
@@ -10,16 +16,108 @@ from PyQt5.QtWidgets import (
     QTabWidget, QListWidget, QMessageBox, QGroupBox,
     QSpinBox, QDoubleSpinBox
 )
-from PyQt5.QtCore import Qt, QTimer, pyqtSlot
-from PyQt5.QtGui import QFont, QTextCursor
+from PyQt5.QtCore import Qt, QObject, QRunnable, QSignalBlocker, QThreadPool, QTimer, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QFont, QTextCharFormat, QTextCursor, QStandardItem, QStandardItemModel
 
-from .config import Config, MODELS
+from .config import Config, MODELS, MODEL_INDEX
 from .gpt_handler import GPTHandler
-from .command_processor import CommandProcessor
+from .command_processor import CommandProcessor, find_forbidden
+from .cache import ResponseCache, open_history
+
+@contextmanager
+def signals_blocked(*widgets):
+    """Block the widgets' signals for programmatic updates, restoring the previous state"""
+    blockers = [QSignalBlocker(w) for w in widgets]
+    try:
+        yield
+    finally:
+        for blocker in blockers:
+            blocker.unblock()
+
+# Plugin-wide output logger; raise its level (or set disabled) to skip all
+# output formatting and widget updates, e.g. for performance runs
+_LOG = logging.getLogger("kritaGPT")
+if _LOG.level == logging.NOTSET:
+    _LOG.setLevel(logging.INFO)
+_LOG.propagate = False  # records are HTML meant for the docker output only
+
+class QTextEditHandler(logging.Handler):
+    """Logging handler that queues formatted records as output HTML
+    
+    Only records tagged with this handler's docker id are taken, since every
+    docker shares the plugin logger. emit_html is the docker's _emit, so
+    records are written by its next _flush.
+    """
+    
+    def __init__(self, docker_id, emit_html):
+        super().__init__()
+        self._docker_id = docker_id
+        self._emit_html = emit_html
+    
+    def emit(self, record):
+        if getattr(record, "docker", None) != self._docker_id:
+            return
+        try:
+            self._emit_html(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+class _GptTaskSignals(QObject):
+    """Signals used by _GptTask to report back to the GUI thread"""
+    finished = pyqtSignal(dict)
+    error = pyqtSignal(str)
+
+class _GptTask(QRunnable):
+    """Runs GPTHandler.get_code on a QThreadPool worker thread"""
+    
+    def __init__(self, handler, command, context=None, cache=None, cache_key=None):
+        super().__init__()
+        self.handler = handler
+        self.command = command
+        self.context = context
+        self.cache = cache
+        self.cache_key = cache_key
+        self.signals = _GptTaskSignals()
+    
+    def run(self):
+        try:
+            result = self.fetch()
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+    
+    def fetch(self):
+        """Get code from the semantic cache or the API"""
+        embedding = None
+        if self.cache is not None and self.cache.semantic:
+            embedding = self.handler.embed(self.command)
+            code = self.cache.get_similar(embedding, self.context)
+            if code is not None:
+                return {"success": True, "code": code, "raw_response": code, "error": None, "cached": True}
+        
+        result = self.handler.get_code(self.command, self.context)
+        # Stored by the docker once the code has run successfully
+        result["cache_key"] = self.cache_key
+        result["embedding"] = embedding
+        result["context"] = self.context
+        return result
 
 class KritaGPTDocker(DockWidget):
     """Main docker widget for KritaGPT"""
     
+    # Status label styles, applied only when the kind of status changes
+    _STATUS_QSS = {
+        "ok": "QLabel { color: green; }",
+        "busy": "QLabel { color: blue; }",
+        "warn": "QLabel { color: orange; }",
+        "err": "QLabel { color: red; }"
+    }
+    
+    # Emitted from the batch event loop thread, delivered on the GUI thread
+    batch_result = pyqtSignal(dict)
+    batch_progress = pyqtSignal(str)
+    
     def __init__(self):
         super().__init__()
         self.setWindowTitle("KritaGPT")
@@ -27,8 +125,21 @@ class KritaGPTDocker(DockWidget):
         # Initialize components
         self.config = Config()
         self.gpt_handler = None
-        self.processor = CommandProcessor()
-        self.command_history = []
+        self.processor = CommandProcessor(
+            self.config.get("trusted_hashes", []),
+            self.config.get("optimize_generated_code", True)
+        )
+        self.response_cache = ResponseCache(
+            self.config.config_dir / "cache",
+            semantic=self.config.get("semantic_cache", False)
+        )
+        self.last_code = None
+        self.command_history = open_history(self.config.config_dir / "history")
+        # Hashes of the stored commands, so repeated commands are not added again
+        self._history_hashes = {hash(cmd) for cmd in self.command_history}
+        # Read once here; kept in sync by save_history_size
+        self.max_history = self.config.get("history_size", 10)
+        self.trim_history(self.max_history)
         self.history_index = -1
         
         # Create main widget
@@ -45,6 +156,25 @@ class KritaGPTDocker(DockWidget):
         self.processor.execution_started.connect(self.on_execution_started)
         self.processor.execution_completed.connect(self.on_execution_completed)
         self.processor.execution_error.connect(self.on_execution_error)
+        
+        # Event loop for concurrent ">>" batches, started on first use
+        self._loop = None
+        
+        # Single-shot timers so spinbox drags only save the final value
+        self._debounce_timers = {}
+        
+        # Output lines waiting to be written to output_text
+        self._out_buf = []
+        # Output goes through the shared plugin logger; records carry this
+        # docker's id, since Krita creates a docker for every main window
+        self._log = logging.LoggerAdapter(_LOG, {"docker": id(self)})
+        handler = QTextEditHandler(id(self), self._emit)
+        _LOG.addHandler(handler)
+        self.destroyed.connect(lambda: _LOG.removeHandler(handler))
+        # Set once the current response has been shown while streaming
+        self._streamed_live = False
+        self.batch_result.connect(self._on_gpt_result)
+        self.batch_progress.connect(lambda text: self._set_status(text, "busy"))
     
     def canvasChanged(self, canvas):
         """Required override for DockWidget - called when canvas changes"""
@@ -63,23 +193,29 @@ class KritaGPTDocker(DockWidget):
         self.setup_main_tab(main_tab)
         self.tabs.addTab(main_tab, "Commands")
         
-        # Settings tab
-        settings_tab = QWidget()
-        self.setup_settings_tab(settings_tab)
-        self.tabs.addTab(settings_tab, "Settings")
-        
-        # History tab
-        history_tab = QWidget()
-        self.setup_history_tab(history_tab)
-        self.tabs.addTab(history_tab, "History")
+        # Settings and History tabs are placeholders until first opened
+        self.tabs.addTab(QWidget(), "Settings")
+        self.tabs.addTab(QWidget(), "History")
+        self._tab_builders = {1: self.setup_settings_tab, 2: self.setup_history_tab}
+        self._tab_built = set()
+        self.tabs.currentChanged.connect(self._materialize_tab)
+    
+    @pyqtSlot(int)
+    def _materialize_tab(self, index):
+        """Build a lazily created tab the first time it is shown"""
+        builder = self._tab_builders.get(index)
+        if builder and index not in self._tab_built:
+            self._tab_built.add(index)
+            builder(self.tabs.widget(index))
     
     def setup_main_tab(self, parent):
         """Setup the main command interface"""
         layout = QVBoxLayout(parent)
         
         # Status label
-        self.status_label = QLabel("Ready")
-        self.status_label.setStyleSheet("QLabel { color: green; }")
+        self.status_label = QLabel()
+        self._status_kind = None
+        self._set_status("Ready", "ok")
         layout.addWidget(self.status_label)
         
         # Command input
@@ -107,6 +243,16 @@ class KritaGPTDocker(DockWidget):
         self.auto_execute_checkbox.setChecked(self.config.get("auto_execute", True))
         button_layout.addWidget(self.auto_execute_checkbox)
         
+        self.batch_mode_checkbox = QCheckBox("Batch Mode")
+        self.batch_mode_checkbox.setToolTip("Send blank-line separated commands together")
+        button_layout.addWidget(self.batch_mode_checkbox)
+        
+        self.trust_btn = QPushButton("Trust Code")
+        self.trust_btn.setToolTip("Skip safety checks when this exact code is generated again")
+        self.trust_btn.setEnabled(False)
+        self.trust_btn.clicked.connect(self.trust_last_code)
+        button_layout.addWidget(self.trust_btn)
+        
         button_layout.addStretch()
         
         self.clear_btn = QPushButton("Clear")
@@ -132,6 +278,13 @@ class KritaGPTDocker(DockWidget):
         # Setup keyboard shortcuts
         self.setup_shortcuts()
     
+    def _set_status(self, text, kind):
+        """Show a status message; kind is a key of _STATUS_QSS"""
+        self.status_label.setText(text)
+        if kind != self._status_kind:
+            self.status_label.setStyleSheet(self._STATUS_QSS[kind])
+            self._status_kind = kind
+    
     def setup_settings_tab(self, parent):
         """Setup the settings interface"""
         layout = QVBoxLayout(parent)
@@ -146,7 +299,8 @@ class KritaGPTDocker(DockWidget):
         current_provider = self.config.get("api_provider", "openai")
         index = self.provider_combo.findData(current_provider)
         if index >= 0:
-            self.provider_combo.setCurrentIndex(index)
+            with signals_blocked(self.provider_combo):
+                self.provider_combo.setCurrentIndex(index)
         self.provider_combo.currentIndexChanged.connect(self.on_provider_changed)
         provider_layout.addWidget(self.provider_combo)
         provider_layout.addStretch()
@@ -199,7 +353,8 @@ class KritaGPTDocker(DockWidget):
         self.temperature_spin = QDoubleSpinBox()
         self.temperature_spin.setRange(0.0, 1.0)
         self.temperature_spin.setSingleStep(0.1)
-        self.temperature_spin.setValue(self.config.get("temperature", 0.1))
+        with signals_blocked(self.temperature_spin):
+            self.temperature_spin.setValue(self.config.get("temperature", 0.1))
         self.temperature_spin.valueChanged.connect(self.save_temperature)
         temp_layout.addWidget(self.temperature_spin)
         temp_layout.addWidget(QLabel("(0=precise, 1=creative)"))
@@ -218,13 +373,18 @@ class KritaGPTDocker(DockWidget):
         history_layout.addWidget(QLabel("History Size:"))
         self.history_spin = QSpinBox()
         self.history_spin.setRange(5, 50)
-        self.history_spin.setValue(self.config.get("history_size", 10))
+        with signals_blocked(self.history_spin):
+            self.history_spin.setValue(self.max_history)
         self.history_spin.valueChanged.connect(self.save_history_size)
         history_layout.addWidget(self.history_spin)
         history_layout.addStretch()
         
         behavior_layout.addLayout(history_layout)
         
+        self.clear_cache_btn = QPushButton("Clear Response Cache")
+        self.clear_cache_btn.clicked.connect(self.clear_response_cache)
+        behavior_layout.addWidget(self.clear_cache_btn)
+        
         behavior_group.setLayout(behavior_layout)
         layout.addWidget(behavior_group)
         
@@ -252,6 +412,7 @@ class KritaGPTDocker(DockWidget):
         layout.addWidget(QLabel("Command History:"))
         
         self.history_list = QListWidget()
+        self._repopulate_history_list(self.command_history)
         self.history_list.itemDoubleClicked.connect(self.use_history_command)
         layout.addWidget(self.history_list)
         
@@ -270,24 +431,39 @@ class KritaGPTDocker(DockWidget):
         # This would be implemented with proper Qt key event handling
         pass
     
+    def build_model_lists(self):
+        """Build one item model per provider; the model combo swaps between them"""
+        self._model_lists = {}
+        for provider, models in MODELS.items():
+            item_model = QStandardItemModel(self)
+            for model_id, model_info in models.items():
+                item = QStandardItem(model_info["description"])
+                item.setData(model_id, Qt.UserRole)
+                item_model.appendRow(item)
+            self._model_lists[provider] = item_model
+    
     def update_model_combo(self):
         """Update model combo based on selected provider"""
-        self.model_combo.clear()
         provider = self.provider_combo.currentData() if hasattr(self, 'provider_combo') else self.config.get("api_provider", "openai")
         
-        if provider == "anthropic":
-            models = MODELS.get("anthropic", {})
-        else:
-            models = MODELS.get("openai", {})
-        
-        for model_id, model_info in models.items():
-            self.model_combo.addItem(model_info["description"], model_id)
+        if not hasattr(self, '_model_lists'):
+            self.build_model_lists()
         
-        # Set current model
-        current_model = self.config.get("model", "gpt-4" if provider == "openai" else "claude-3-5-sonnet-20241022")
-        index = self.model_combo.findData(current_model)
-        if index >= 0:
-            self.model_combo.setCurrentIndex(index)
+        # Swapping the model must not fire save_model for intermediate indexes
+        with signals_blocked(self.model_combo):
+            self.model_combo.setModel(self._model_lists.get(provider, self._model_lists["openai"]))
+            
+            # Set current model
+            index = self.model_combo.findData(self.get_current_model(provider))
+            if index >= 0:
+                self.model_combo.setCurrentIndex(index)
+    
+    def get_current_model(self, provider):
+        """Return the configured model, or the provider default if it belongs to another provider"""
+        model = self.config.get("model")
+        if model in MODEL_INDEX and MODEL_INDEX[model]["provider"] == provider:
+            return model
+        return "gpt-4" if provider == "openai" else "claude-3-5-sonnet-20241022"
     
     @pyqtSlot(int)
     def on_provider_changed(self, index):
@@ -320,14 +496,20 @@ class KritaGPTDocker(DockWidget):
             api_key = self.config.get("openai_api_key", self.config.get("api_key", ""))
         
         if api_key:
-            model = self.model_combo.currentData() if hasattr(self, 'model_combo') and self.model_combo.count() > 0 else self.config.get("model", "gpt-4")
+            model = self.model_combo.currentData() if hasattr(self, 'model_combo') and self.model_combo.count() > 0 else self.get_current_model(provider)
             temperature = self.config.get("temperature", 0.1)
-            self.gpt_handler = GPTHandler(provider, api_key, model, temperature)
-            self.status_label.setText(f"Ready ({provider.title()} configured)")
-            self.status_label.setStyleSheet("QLabel { color: green; }")
+            handler = self.gpt_handler
+            if handler and handler.provider == provider and handler.api_key == api_key:
+                # Keep the existing handler and its connection pool
+                handler.set_model(model)
+                handler.set_temperature(temperature)
+            else:
+                self.gpt_handler = GPTHandler(provider, api_key, model, temperature)
+                self.gpt_handler.token_received.connect(self._on_token)
+            self.gpt_handler.api_top_k = self.config.get("api_sections_top_k", 3)
+            self._set_status(f"Ready ({provider.title()} configured)", "ok")
         else:
-            self.status_label.setText(f"Please configure {provider.title()} API key in Settings")
-            self.status_label.setStyleSheet("QLabel { color: orange; }")
+            self._set_status(f"Please configure {provider.title()} API key in Settings", "warn")
             self.gpt_handler = None
     
     def initialize_gpt(self):
@@ -347,6 +529,13 @@ class KritaGPTDocker(DockWidget):
             self.show_error("Please configure your API key in Settings tab")
             return
         
+        # Several lines starting with ">>" are independent commands run concurrently
+        lines = [line.strip() for line in command.splitlines() if line.strip()]
+        batch = [line[2:].strip() for line in lines if line.startswith(">>")]
+        if len(batch) > 1 and len(batch) != len(lines):
+            self.show_error("Start every line with >> to run a batch, or none of them")
+            return
+        
         # Add to history
         self.add_to_history(command)
         
@@ -355,62 +544,189 @@ class KritaGPTDocker(DockWidget):
             self.output_text.clear()
         
         # Show processing
-        self.status_label.setText("Processing...")
-        self.status_label.setStyleSheet("QLabel { color: blue; }")
+        self._set_status("Processing...", "busy")
         self.execute_btn.setEnabled(False)
         
-        # Process with GPT
-        QTimer.singleShot(100, lambda: self.process_command(command))
+        # Krita's API is not thread-safe, so the document context is read here
+        context = self.gpt_handler.get_context()
+        
+        if len(batch) > 1:
+            self.run_batch(batch, context)
+            return
+        
+        # In batch mode, blank-line separated prompts are sent together
+        if self.batch_mode_checkbox.isChecked():
+            prompts = [p.strip() for p in re.split(r"\n\s*\n", command) if p.strip()]
+            if len(prompts) > 1:
+                use_batch_api = self.config.get("use_batch_api", False)
+                self.run_batch(prompts, context, use_batch_api)
+                if use_batch_api:
+                    # Batch API jobs can take hours; keep the docker usable meanwhile
+                    self.execute_btn.setEnabled(True)
+                return
+        
+        # Identical requests reuse the code generated last time
+        handler = self.gpt_handler
+        # Keyed on the full prompt, so code is only reused for the same document state
+        prompt = handler.build_prompt(command, context)
+        cache_key = ResponseCache.make_key(handler.provider, handler.model, handler.temperature, prompt)
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            self._on_gpt_result({"success": True, "code": cached, "raw_response": cached, "error": None, "cached": True})
+            return
+        
+        # Process with GPT on a worker thread; results arrive via signals
+        self._streamed_live = False
+        task = _GptTask(handler, command, context, self.response_cache, cache_key)
+        task.signals.finished.connect(self._on_gpt_result)
+        task.signals.error.connect(self._on_gpt_error)
+        QThreadPool.globalInstance().start(task)
+    
+    def _ensure_loop(self):
+        """Start the background asyncio loop used for concurrent batches"""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return self._loop
+    
+    def run_batch(self, commands, context=None, use_batch_api=False):
+        """Request code for several commands without blocking the GUI"""
+        limit = self.config.get("max_concurrency", 4)
+        asyncio.run_coroutine_threadsafe(
+            self._batch(self.gpt_handler, commands, context, limit, use_batch_api), self._ensure_loop()
+        )
     
-    def process_command(self, command):
-        """Process command with GPT and execute"""
+    async def _batch(self, handler, commands, context, limit, use_batch_api):
+        """Fetch code for all commands, then report results in order"""
+        try:
+            if use_batch_api:
+                results = await handler.aget_code_batch_api(commands, context, on_progress=self.batch_progress.emit)
+            else:
+                results = await handler.aget_code_batch(commands, context, limit, on_progress=self.batch_progress.emit)
+        except Exception as e:
+            results = [{"success": False, "error": str(e), "code": None}]
+        
+        # Scripts run in the order they were typed, whatever order they finish in
+        for command, result in zip(commands, results):
+            if use_batch_api:
+                # Batch API results can arrive hours later, when another document
+                # may be active; they are shown but never run automatically
+                result = dict(result, deferred=True, command=command)
+            self.batch_result.emit(result)
+    
+    @pyqtSlot(dict)
+    def _on_gpt_result(self, result):
+        """Show and execute the code returned by GPT (runs on the GUI thread)"""
         try:
-            # Get code from GPT
-            result = self.gpt_handler.get_code(command)
-            
             if not result["success"]:
                 self.show_error(f"API Error: {result['error']}")
                 return
             
             code = result["code"]
+            self.last_code = code
+            self.trust_btn.setEnabled(True)
             
-            # Show code if requested
-            if self.show_code_checkbox.isChecked():
-                self.output_text.append(f"<b>Generated Code:</b>")
-                self.output_text.append(f"<pre>{code}</pre>")
-                self.output_text.append("")
+            if result.get("deferred"):
+                self._log.info("<b>Batch result for:</b> %s", result["command"])
+                self._log.info("<pre>%s</pre>", code)
+                self._log.info("Not run: generated for the document that was active when the batch was sent")
+                return
+            
+            # Show code if requested, unless it was already shown while streaming
+            if (self.show_code_checkbox.isChecked() and not self._streamed_live
+                    and self._log.isEnabledFor(logging.INFO)):
+                self._log.info("<b>Generated Code:</b>")
+                self._log.info("<pre>%s</pre>", code)
+                self._log.info("")
+            
+            # Reject known API mistakes before running anything
+            hits = find_forbidden(code)
+            if hits:
+                self.show_error(f"Refusing to run: forbidden API {', '.join(hits)}")
+                return
             
             # Execute code
             auto_execute = self.auto_execute_checkbox.isChecked()
             exec_result = self.processor.execute(code, auto_execute)
             
             if exec_result["success"]:
-                self.output_text.append(f"<span style='color: green;'>✓ {exec_result['message']}</span>")
+                self._log.info("<span style='color: green;'>✓ %s</span>", exec_result["message"])
+                # Only code that was validated and actually ran is worth reusing
+                if result.get("cache_key") and exec_result.get("executed"):
+                    self.response_cache.set(result["cache_key"], code, result.get("embedding"), result.get("context"))
             else:
                 self.show_error(f"Execution Error: {exec_result['error']}")
                 if self.show_code_checkbox.isChecked() and 'traceback' in exec_result:
-                    self.output_text.append(f"<pre>{exec_result['traceback']}</pre>")
+                    self._log.error("<pre>%s</pre>", exec_result["traceback"])
             
         except Exception as e:
             self.show_error(f"Unexpected error: {str(e)}")
         
         finally:
-            self.status_label.setText("Ready")
-            self.status_label.setStyleSheet("QLabel { color: green; }")
+            self._flush()
+            self._streamed_live = False
+            self._set_status("Ready", "ok")
             self.execute_btn.setEnabled(True)
     
+    @pyqtSlot(str)
+    def _on_gpt_error(self, error):
+        """Handle an exception raised while requesting code"""
+        self._streamed_live = False
+        self.show_error(f"Unexpected error: {error}")
+        self.execute_btn.setEnabled(True)
+    
+    @pyqtSlot(str)
+    def _on_token(self, delta):
+        """Show the response as it streams in when Show Code is checked"""
+        if not self.show_code_checkbox.isChecked():
+            return
+        cursor = self.output_text.textCursor()
+        if not self._streamed_live:
+            self._log.info("<b>Generated Code:</b>")
+            self._flush()
+            self._streamed_live = True
+            # Start the code on its own line, below the heading
+            cursor.movePosition(QTextCursor.End)
+            cursor.insertBlock()
+        cursor.movePosition(QTextCursor.End)
+        # Plain format, so the text does not inherit the bold heading
+        cursor.insertText(delta, QTextCharFormat())
+        self.output_text.setTextCursor(cursor)
+    
     def add_to_history(self, command):
         """Add command to history"""
+        key = hash(command)
+        if key in self._history_hashes:
+            return
+        self._history_hashes.add(key)
         self.command_history.append(command)
-        self.history_list.addItem(command)
+        if hasattr(self, 'history_list'):
+            self.history_list.addItem(command)
         
         # Limit history size
-        max_history = self.config.get("history_size", 10)
-        if len(self.command_history) > max_history:
-            self.command_history = self.command_history[-max_history:]
-            self.history_list.clear()
-            for cmd in self.command_history:
-                self.history_list.addItem(cmd)
+        self.trim_history(self.max_history)
+    
+    def trim_history(self, max_history):
+        """Drop the oldest history entries beyond max_history"""
+        removed = 0
+        while len(self.command_history) > max_history:
+            self._history_hashes.discard(hash(self.command_history.popleft()))
+            removed += 1
+        
+        # The list widget only exists once the History tab has been opened
+        if not removed or not hasattr(self, 'history_list'):
+            return
+        if removed == 1:
+            self.history_list.takeItem(0)
+        else:
+            self._repopulate_history_list(self.command_history)
+    
+    def _repopulate_history_list(self, cmds):
+        """Replace the history list contents with a single repaint"""
+        self.history_list.setUpdatesEnabled(False)
+        self.history_list.clear()
+        self.history_list.addItems(list(cmds))
+        self.history_list.setUpdatesEnabled(True)
     
     def use_history_command(self, item):
         """Use command from history"""
@@ -420,31 +736,95 @@ class KritaGPTDocker(DockWidget):
     def clear_history(self):
         """Clear command history"""
         self.command_history.clear()
+        self._history_hashes.clear()
         self.history_list.clear()
+        self.processor.clear_cache()
         if self.gpt_handler:
             self.gpt_handler.clear_history()
     
+    @pyqtSlot()
+    def trust_last_code(self):
+        """Trust the last generated code so it skips validation next time"""
+        if not self.last_code:
+            return
+        
+        reply = QMessageBox.question(
+            self, "Trust Code",
+            "Run this exact code without safety checks in the future?"
+        )
+        if reply != QMessageBox.Yes:
+            return
+        
+        digest = self.processor.trust(self.last_code)
+        trusted = self.config.get("trusted_hashes", [])
+        if digest not in trusted:
+            self.config.set("trusted_hashes", trusted + [digest])
+        self._log.info("<span style='color: green;'>✓ Code marked as trusted</span>")
+        self._flush()
+    
+    def clear_response_cache(self):
+        """Forget all cached responses"""
+        self.response_cache.clear()
+        QMessageBox.information(self, "Success", "Response cache cleared!")
+    
     def clear_output(self):
         """Clear output text"""
         self.output_text.clear()
     
+    def _emit(self, html):
+        """Queue a line of output; written by the next _flush"""
+        self._out_buf.append(html)
+    
+    def _flush(self):
+        """Write all queued output lines with a single insert"""
+        if not self._out_buf:
+            return
+        cursor = self.output_text.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        if not self.output_text.document().isEmpty():
+            cursor.insertBlock()
+        cursor.insertHtml("<br>".join(self._out_buf))
+        self.output_text.setTextCursor(cursor)
+        self._out_buf.clear()
+    
     def show_error(self, message):
         """Show error in output"""
-        self.output_text.append(f"<span style='color: red;'>✗ {message}</span>")
-        self.status_label.setText("Error")
-        self.status_label.setStyleSheet("QLabel { color: red; }")
+        self._log.error("<span style='color: red;'>✗ %s</span>", message)
+        self._flush()
+        self._set_status("Error", "err")
     
     @pyqtSlot(int)
     def save_model(self, index):
         """Save selected model"""
         model = self.model_combo.itemData(index)
+        if model not in MODEL_INDEX:
+            return
         self.config.set("model", model)
         if self.gpt_handler:
             self.gpt_handler.set_model(model)
     
+    def _debounced(self, key, fn, delay=300):
+        """Run fn once no new call for the same key arrived within delay ms"""
+        timer = self._debounce_timers.get(key)
+        if timer is None:
+            timer = QTimer(self)
+            timer.setSingleShot(True)
+            self._debounce_timers[key] = timer
+        else:
+            try:
+                timer.timeout.disconnect()
+            except TypeError:
+                pass
+        timer.timeout.connect(fn)
+        timer.start(delay)
+    
     @pyqtSlot(float)
     def save_temperature(self, value):
         """Save temperature setting"""
+        self._debounced("temperature", lambda: self._apply_temperature(value))
+    
+    def _apply_temperature(self, value):
+        """Store the temperature and pass it to the handler"""
         self.config.set("temperature", value)
         if self.gpt_handler:
             self.gpt_handler.set_temperature(value)
@@ -452,25 +832,29 @@ class KritaGPTDocker(DockWidget):
     @pyqtSlot(int)
     def save_history_size(self, value):
         """Save history size setting"""
+        self._debounced("history_size", lambda: self._apply_history_size(value))
+    
+    def _apply_history_size(self, value):
+        """Store the history size and trim the history to it"""
         self.config.set("history_size", value)
+        self.max_history = value
+        
+        self.trim_history(value)
     
     @pyqtSlot()
     def on_execution_started(self):
         """Handle execution started signal"""
-        self.status_label.setText("Executing...")
-        self.status_label.setStyleSheet("QLabel { color: blue; }")
+        self._set_status("Executing...", "busy")
     
     @pyqtSlot(dict)
     def on_execution_completed(self, result):
         """Handle execution completed signal"""
-        self.status_label.setText("Ready")
-        self.status_label.setStyleSheet("QLabel { color: green; }")
+        self._set_status("Ready", "ok")
     
     @pyqtSlot(str)
     def on_execution_error(self, error):
         """Handle execution error signal"""
-        self.status_label.setText("Execution Error")
-        self.status_label.setStyleSheet("QLabel { color: red; }")
+        self._set_status("Execution Error", "err")
 
 # Factory for creating the docker
 class KritaGPTDockerFactory(DockWidgetFactory):
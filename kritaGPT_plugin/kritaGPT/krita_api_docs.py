@@ -3,6 +3,9 @@ Comprehensive Krita Python API Documentation
 This module contains the complete API reference for accurate code generation
 """
 
+import re
+from typing import Dict, Optional, Tuple
+
 KRITA_API_REFERENCE = """
 ## KRITA PYTHON API - USE ONLY THESE METHODS
 
@@ -127,4 +130,77 @@ if doc:
 - rotateNode needs RADIANS: math.radians(degrees)
 - opacity is 0-255, not 0-100
 - ALWAYS call doc.refreshProjection() at the end
-"""
\ No newline at end of file
+"""
+# Sections sent with every request, whatever the command; the prompt only
+# allows documented methods, so the method lists are never trimmed
+ALWAYS_INCLUDED = (
+    "CRITICAL RULES", "Getting Started", "Document Methods", "Node", "Selection",
+    "DO NOT USE", "REMEMBER"
+)
+
+_EXAMPLES_HEADING = "### COMMON WORKING EXAMPLES:"
+
+# Words too common in the reference to say anything about a section
+_STOPWORDS = frozenset({
+    "a", "an", "and", "the", "to", "of", "in", "on", "by", "for", "if", "is",
+    "it", "not", "only", "use", "get", "set", "str", "int", "none", "or",
+    "doc", "app", "my", "this", "with", "make", "please",
+})
+
+def _tokens(text: str) -> set:
+    """Lowercase words of text, with camelCase split and a plural 's' dropped"""
+    words = (w.lower() for w in re.findall(r'[A-Z]?[a-z]+', text))
+    return {w[:-1] if len(w) > 3 and w.endswith('s') else w
+            for w in words if w not in _STOPWORDS}
+
+def _split_sections(reference: str) -> Tuple[str, Dict[str, str]]:
+    """Split the reference into its preamble and {heading: text} sections
+    
+    Each working example becomes its own "Examples/<title>" section.
+    """
+    preamble, *parts = re.split(r'\n(?=### )', reference.strip("\n"))
+    sections = {}
+    for part in parts:
+        heading = re.match(r'### ([^:(\n]+)', part).group(1).strip()
+        if not part.startswith(_EXAMPLES_HEADING):
+            sections[heading] = part.strip("\n")
+            continue
+        body = part[len(_EXAMPLES_HEADING):].strip("\n")
+        for example in re.split(r'\n\n(?=[A-Z][^\n`]*:\n)', body):
+            title = example.split(":", 1)[0]
+            sections[f"Examples/{title}"] = example.strip("\n")
+    return preamble.strip("\n"), sections
+
+_PREAMBLE, API_SECTIONS = _split_sections(KRITA_API_REFERENCE)
+
+# Keyword index: section heading -> words that appear in it
+_SECTION_TOKENS = {name: _tokens(name + " " + text) for name, text in API_SECTIONS.items()}
+
+def select_api_sections(command: str, top_k: int = 3) -> Optional[Tuple[str, ...]]:
+    """Names of the sections relevant to command, in reference order
+    
+    Returns None when no section matches, meaning the full reference should be used.
+    """
+    words = _tokens(command)
+    scores = {
+        name: len(words & tokens)
+        for name, tokens in _SECTION_TOKENS.items()
+        if name not in ALWAYS_INCLUDED
+    }
+    # sorted() is stable, so ties keep reference order
+    best = [name for name in sorted(scores, key=scores.get, reverse=True)[:top_k] if scores[name]]
+    if not best:
+        return None
+    chosen = set(best).union(ALWAYS_INCLUDED)
+    return tuple(name for name in API_SECTIONS if name in chosen)
+
+def build_api_reference(names: Tuple[str, ...]) -> str:
+    """Join the named sections back into a reference in the original layout"""
+    parts = [_PREAMBLE]
+    in_examples = False
+    for name in names:
+        if name.startswith("Examples/") and not in_examples:
+            parts.append(_EXAMPLES_HEADING)
+            in_examples = True
+        parts.append(API_SECTIONS[name])
+    return "\n\n".join(parts) + "\n"